@@ -1,14 +1,18 @@
+import json
 import logging
 import os
+import re
 import sys
-from contextlib import contextmanager
+from contextlib import contextmanager, suppress
 from datetime import timedelta
 from pathlib import Path
 from typing import Iterable, Iterator, Protocol
 
 from anki.collection import Collection
+from anki.errors import SyncError, SyncErrorKind
+from anki.media import MediaManager
 from anki.notes import Note
-from anki.sync import SyncAuth
+from anki.sync import SyncAuth, SyncOutput
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 logger = logging.getLogger(__name__)
@@ -33,6 +37,8 @@ class AnkiClient(Protocol):
 
     def notes_in_deck(self, deck: str) -> Iterable[Note]: ...
 
+    def all_notes(self) -> Iterable[Note]: ...
+
     def update_note(self, note: Note) -> None: ...
 
     def media_file_exists(self, file_name: str) -> bool: ...
@@ -41,6 +47,27 @@ class AnkiClient(Protocol):
 
     def add_media_file(self, file_name: str, data: bytes) -> None: ...
 
+    def media_files(self) -> Iterable[str]: ...
+
+    def read_media_file(self, file_name: str) -> bytes: ...
+
+    def template_texts(self) -> Iterable[str]: ...
+
+    def generated_media_files(self) -> set[str]: ...
+
+    def register_generated_media_files(self, file_names: Iterable[str]) -> None: ...
+
+    def forget_generated_media_files(self, file_names: Iterable[str]) -> None: ...
+
+
+def media_references(text: str) -> list[str]:
+    """Return all media files referenced in text, using the same patterns as Anki's media check."""
+    return [
+        match.group("fname")
+        for regexp in MediaManager.regexps
+        for match in re.finditer(regexp, text)
+    ]
+
 
 class AnkiClientException(Exception):
     pass
@@ -55,22 +82,120 @@ class MediaSyncInProgressException(Exception):
     pass
 
 
+ANKIWEB_SYNC_ENDPOINT = "https://sync.ankiweb.net/"
+
+# Collection config key under which the names of all media files generated by anki-hanzi are recorded. Being part of
+# the collection, the record is synced along with it.
+_GENERATED_MEDIA_FILES_CONFIG_KEY = "ankiHanziGeneratedMediaFiles"
+
+
+class SyncAuthCache:
+    """Persist the sync auth token so that later runs can skip the login.
+
+    The token is as good as the password for syncing, so the file is only readable by the current user. Entries are
+    bound to the username and the endpoint they were obtained for. A token for another account is never reused.
+    """
+
+    _path: Path
+
+    def __init__(self, path: Path):
+        self._path = path
+
+    def load(self, username: str, login_endpoint: str) -> SyncAuth | None:
+        try:
+            with open(self._path) as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logger.warning(f"Ignoring unreadable sync auth cache: {self._path}")
+            return None
+
+        if not isinstance(cached, dict):
+            logger.warning(f"Ignoring malformed sync auth cache: {self._path}")
+            return None
+        if cached.get("username") != username:
+            return None
+        if cached.get("login_endpoint") != login_endpoint:
+            return None
+        try:
+            return SyncAuth(hkey=cached["hkey"], endpoint=cached["endpoint"])
+        except (KeyError, TypeError):
+            # Missing keys or values of the wrong type
+            logger.warning(f"Ignoring malformed sync auth cache: {self._path}")
+            return None
+
+    def store(self, username: str, login_endpoint: str, auth: SyncAuth) -> None:
+        # Write to a temporary file created with restricted permissions and move it into place, so the token is never
+        # readable by others and a crash cannot leave a truncated cache behind.
+        temporary_path = self._path.with_name(f".{self._path.name}.tmp")
+        try:
+            self._path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump(
+                    {
+                        "username": username,
+                        "login_endpoint": login_endpoint,
+                        "hkey": auth.hkey,
+                        "endpoint": auth.endpoint,
+                    },
+                    f,
+                )
+            os.replace(temporary_path, self._path)
+        except OSError as e:
+            # Caching is an optimization. The next run simply logs in again.
+            logger.warning(f"Cannot write sync auth cache {self._path}: {e}")
+            with suppress(OSError):
+                temporary_path.unlink(missing_ok=True)
+
+    def clear(self) -> None:
+        try:
+            self._path.unlink(missing_ok=True)
+        except OSError as e:
+            # The stale token will be rejected again by the next run, which then logs in as well.
+            logger.warning(f"Cannot remove sync auth cache {self._path}: {e}")
+
+
 class AnkiClientImpl(AnkiClient):
     _username: str
     _password: str
+    _endpoint: str
     _auth: SyncAuth
+    _auth_cache: SyncAuthCache | None
     _collection: Collection
-
-    def __init__(self, collection_path: Path, username: str, password: str):
+    # Loaded lazily from the collection config and written back on sync(), so that recording a file does not rewrite
+    # the whole config entry every time.
+    _generated_media_files: set[str] | None
+    _generated_media_files_modified: bool
+
+    def __init__(
+        self,
+        collection_path: Path,
+        username: str,
+        password: str,
+        endpoint: str = ANKIWEB_SYNC_ENDPOINT,
+        auth_cache: SyncAuthCache | None = None,
+    ):
         # This also works if the file does not exist, yet. The constructor will set up an empty database.
         # The initial sync/download is handled by sync()
         self._collection = Collection(path=str(collection_path))
 
         self._username = username
         self._password = password
-        self.init_auth()
-
-    def init_auth(self, endpoint: str = "https://sync.ankiweb.net/") -> None:
+        self._endpoint = endpoint
+        self._auth_cache = auth_cache
+        self._generated_media_files = None
+        self._generated_media_files_modified = False
+
+        cached_auth = auth_cache.load(username, endpoint) if auth_cache else None
+        if cached_auth is not None:
+            # Skip the login. If the server rejects the token, sync() logs in again.
+            self._auth = cached_auth
+        else:
+            self.init_auth(endpoint)
+
+    def init_auth(self, endpoint: str = ANKIWEB_SYNC_ENDPOINT) -> None:
         with suppress_stdout():
             # This function is very noisy. It prints stacks traces on stdout just because some function call takes
             # longer than 100 ms. This is nothing we care about. For lack of a better mechanism to control these logs,
@@ -81,6 +206,14 @@ class AnkiClientImpl(AnkiClient):
                 endpoint=endpoint,
             )
 
+        if self._auth_cache is not None:
+            self._auth_cache.store(self._username, self._endpoint, self._auth)
+
+    def _sync_collection(self) -> SyncOutput:
+        with suppress_stdout():
+            # This function is very noisy, just like self._collection.sync_login()
+            return self._collection.sync_collection(auth=self._auth, sync_media=True)
+
     @retry(
         wait=wait_exponential(min=timedelta(seconds=1), max=timedelta(seconds=30)),
         stop=stop_after_attempt(50),
@@ -91,12 +224,29 @@ class AnkiClientImpl(AnkiClient):
         if self._collection.media_sync_status().active:
             raise MediaSyncInProgressException()
 
-    def sync(self) -> None:
-        with suppress_stdout():
-            # This function is very noisy, just like self._collection.sync_login()
-            sync_result = self._collection.sync_collection(
-                auth=self._auth, sync_media=True
+    def _save_generated_media_files(self) -> None:
+        if self._generated_media_files_modified:
+            assert self._generated_media_files is not None
+            self._collection.set_config(
+                _GENERATED_MEDIA_FILES_CONFIG_KEY, sorted(self._generated_media_files)
             )
+            self._generated_media_files_modified = False
+
+    def sync(self) -> None:
+        self._save_generated_media_files()
+        # Reload after syncing, the record may have changed remotely or been replaced by a full download.
+        self._generated_media_files = None
+
+        try:
+            sync_result = self._sync_collection()
+        except SyncError as e:
+            if e.kind != SyncErrorKind.AUTH or self._auth_cache is None:
+                raise
+            # The cached token has been revoked or expired, e.g. because the password changed. Log in again once.
+            logger.info("Sync server rejected cached credentials. Logging in again.")
+            self._auth_cache.clear()
+            self.init_auth(self._endpoint)
+            sync_result = self._sync_collection()
 
         if sync_result.required in [sync_result.FULL_DOWNLOAD, sync_result.FULL_SYNC]:
             if sync_result.required == sync_result.FULL_DOWNLOAD:
@@ -111,8 +261,9 @@ class AnkiClientImpl(AnkiClient):
             # See Anki-Android who ran into the same problem:
             # - Issue: https://github.com/ankidroid/Anki-Android/issues/14219
             # - Fix: https://github.com/ankidroid/Anki-Android/pull/14935/commits/f90c1d87ddb5aaa23fa89ee28bca5335ff673971
-            assert sync_result.new_endpoint
-            self.init_auth(sync_result.new_endpoint)
+            # Self-hosted sync servers do not redirect, so there may be no new endpoint at all.
+            if sync_result.new_endpoint:
+                self.init_auth(sync_result.new_endpoint)
 
             self._collection.close_for_full_sync()
             with suppress_stdout():
@@ -143,6 +294,10 @@ class AnkiClientImpl(AnkiClient):
         for note_id in note_ids:
             yield self._collection.get_note(note_id)
 
+    def all_notes(self) -> Iterable[Note]:
+        for note_id in self._collection.find_notes(query=""):
+            yield self._collection.get_note(note_id)
+
     def update_note(self, note: Note) -> None:
         self._collection.update_note(note)
 
@@ -167,3 +322,37 @@ class AnkiClientImpl(AnkiClient):
             raise AnkiClientException(
                 f"Actual file name not equal despite requested file name not existing. Requested: {file_name} Actual: {actual_file_name}"
             )
+
+    def media_files(self) -> Iterable[str]:
+        with os.scandir(self._collection.media.dir()) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry.name
+
+    def read_media_file(self, file_name: str) -> bytes:
+        return (Path(self._collection.media.dir()) / file_name).read_bytes()
+
+    def template_texts(self) -> Iterable[str]:
+        for notetype in self._collection.models.all():
+            yield notetype["css"]
+            for template in notetype["tmpls"]:
+                yield template["qfmt"]
+                yield template["afmt"]
+
+    def _loaded_generated_media_files(self) -> set[str]:
+        if self._generated_media_files is None:
+            self._generated_media_files = set(
+                self._collection.get_config(_GENERATED_MEDIA_FILES_CONFIG_KEY, [])
+            )
+        return self._generated_media_files
+
+    def generated_media_files(self) -> set[str]:
+        return set(self._loaded_generated_media_files())
+
+    def register_generated_media_files(self, file_names: Iterable[str]) -> None:
+        self._loaded_generated_media_files().update(file_names)
+        self._generated_media_files_modified = True
+
+    def forget_generated_media_files(self, file_names: Iterable[str]) -> None:
+        self._loaded_generated_media_files().difference_update(file_names)
+        self._generated_media_files_modified = True
@@ -0,0 +1,152 @@
+import hashlib
+import logging
+import re
+from collections import Counter, defaultdict
+from typing import TypedDict
+
+from anki.notes import Note
+
+from anki_hanzi.anki_client import AnkiClient, media_references
+from anki_hanzi.processing import (
+    ANKI_HANZI_TAG,
+    GENERATED_SPEECH_FIELDS,
+    make_media_file_name,
+    strip_html_tags,
+)
+
+logger = logging.getLogger(__name__)
+
+SOUND_TAG = re.compile(r"\[sound:(.+?)\]")
+
+# Audio generated by anki-hanzi is always stored as mp3, see processing.synthesize().
+GENERATED_AUDIO_EXTENSION = "mp3"
+
+
+class CompactionStats(TypedDict):
+    orphaned_files: int
+    duplicate_files: int
+    rewritten_notes: int
+    bytes_reclaimed: int
+
+
+def _is_generated_speech_field(note: Note, field_name: str) -> bool:
+    return note.has_tag(ANKI_HANZI_TAG) and field_name in GENERATED_SPEECH_FIELDS
+
+
+def _choose_canonical(file_names: list[str], references: Counter[str]) -> str:
+    """Keep the most referenced file so that as few notes as possible have to be rewritten."""
+    return min(file_names, key=lambda name: (-references[name], len(name), name))
+
+
+def compact_media(
+    anki: AnkiClient, dry_run: bool = False, include_unrecorded_mp3: bool = False
+) -> CompactionStats:
+    """Trash generated audio that no note references anymore and merge byte-identical duplicates.
+
+    Only files generated by anki-hanzi are considered: files recorded when they were generated, files referenced from
+    the generated speech fields of processed notes and files named like the audio of a processed note would be. Files
+    referenced in any other way, by other notes, other fields or card templates, are never touched. Only the generated
+    speech fields of processed notes are rewritten to reference the canonical copy of a duplicate. With dry_run
+    nothing is changed, only the stats of what would be done are returned.
+
+    Files generated before anki-hanzi started recording them are only recognized while a processed note references them
+    or is named after them. With include_unrecorded_mp3, every mp3 file that is not referenced in any way is considered
+    generated as well, so that orphans from such older runs can be reclaimed. This includes mp3 files added by other
+    means, so it has to be asked for explicitly.
+    """
+    notes = list(anki.all_notes())
+
+    # References from generated speech fields of processed notes. These are the only references we may rewrite.
+    references: Counter[str] = Counter()
+    # Files referenced in any other way. These must be kept as they are.
+    preserved: set[str] = set()
+    # Files named like the audio generated for the current contents of a processed note.
+    expected: set[str] = set()
+    for note in notes:
+        for field_name, field in note.items():
+            if _is_generated_speech_field(note, field_name):
+                sounds = SOUND_TAG.findall(field)
+                references.update(sounds)
+                preserved.update(set(media_references(field)) - set(sounds))
+            else:
+                preserved.update(media_references(field))
+
+        if note.has_tag(ANKI_HANZI_TAG):
+            for source_field in GENERATED_SPEECH_FIELDS.values():
+                if source_field not in note:
+                    continue
+                text = strip_html_tags(note[source_field]).strip()
+                if text:
+                    expected.add(make_media_file_name(text, GENERATED_AUDIO_EXTENSION))
+
+    templates = "\n".join(anki.template_texts())
+    generated = anki.generated_media_files() | set(references) | expected
+
+    def may_touch(file_name: str) -> bool:
+        if file_name not in generated and not include_unrecorded_mp3:
+            return False
+        if not file_name.endswith(f".{GENERATED_AUDIO_EXTENSION}"):
+            return False
+        # Anki never treats files starting with an underscore as unused, they may be referenced by card templates.
+        if file_name.startswith("_"):
+            return False
+        # Templates can reference media in many ways, e.g. from scripts. Keep every file they mention at all.
+        return file_name not in preserved and file_name not in templates
+
+    orphaned: list[str] = []
+    by_digest: defaultdict[str, list[str]] = defaultdict(list)
+    sizes: dict[str, int] = {}
+    for file_name in anki.media_files():
+        if not may_touch(file_name):
+            continue
+        data = anki.read_media_file(file_name)
+        sizes[file_name] = len(data)
+        if references[file_name] == 0:
+            orphaned.append(file_name)
+        else:
+            by_digest[hashlib.sha256(data).hexdigest()].append(file_name)
+
+    replacements: dict[str, str] = {}
+    for file_names in by_digest.values():
+        if len(file_names) < 2:
+            continue
+        canonical = _choose_canonical(file_names, references)
+        for file_name in file_names:
+            if file_name != canonical:
+                replacements[file_name] = canonical
+
+    def replace_reference(match: re.Match[str]) -> str:
+        file_name = match.group(1)
+        return f"[sound:{replacements.get(file_name, file_name)}]"
+
+    rewritten_notes = 0
+    for note in notes:
+        note_modified = False
+        for field_name, field in note.items():
+            if not _is_generated_speech_field(note, field_name):
+                continue
+            result = SOUND_TAG.sub(replace_reference, field)
+            if result != field:
+                note[field_name] = result
+                note_modified = True
+
+        if note_modified:
+            rewritten_notes += 1
+            if not dry_run:
+                anki.update_note(note)
+
+    to_trash = orphaned + list(replacements)
+    if not dry_run:
+        # Only trash files once no note references them anymore.
+        for file_name in to_trash:
+            anki.delete_media_file(file_name)
+        # Record what is referenced now, so these files are recognized even if a later run changes the references.
+        anki.register_generated_media_files(set(references) - set(replacements))
+        anki.forget_generated_media_files(to_trash)
+
+    return {
+        "orphaned_files": len(orphaned),
+        "duplicate_files": len(replacements),
+        "rewritten_notes": rewritten_notes,
+        "bytes_reclaimed": sum(sizes[file_name] for file_name in to_trash),
+    }
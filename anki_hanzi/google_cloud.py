@@ -1,8 +1,15 @@
 import json
 from pathlib import Path
+from typing import Any
 
+from google.api_core import gapic_v1
+
+from anki_hanzi.hedging import Attempt
 from anki_hanzi.language import Language
 
+# api_core is untyped
+_CLIENT_INFO = gapic_v1.client_info.ClientInfo()  # type: ignore[no-untyped-call]
+
 
 def project_id_from_application_credentials(
     application_credentials: Path,
@@ -20,3 +27,24 @@ def language_to_google_language_code(language: Language) -> str:
         "Chinese_Traditional": "zh-TW",
         "English": "en",
     }[language]
+
+
+def start_unary_call(
+    stub: Any,
+    request: Any,
+    timeout: float,
+    routing: tuple[tuple[str, str], ...] = (),
+) -> Attempt[Any]:
+    """Start a call on the gRPC stub of a client's transport, e.g. client.transport.translate_text.
+
+    Unlike the client's own method, which blocks until the response arrives, this returns a future that can be cancelled
+    once its response is no longer needed. Adds the metadata the client's method would add. None of the methods used
+    here are retried by the client, so nothing else is lost.
+    """
+    metadata = [_CLIENT_INFO.to_grpc_metadata()]  # type: ignore[no-untyped-call]
+    if routing:
+        metadata.append(
+            gapic_v1.routing_header.to_grpc_metadata(routing)  # type: ignore[no-untyped-call]
+        )
+    future: Attempt[Any] = stub.future(request, timeout=timeout, metadata=metadata)
+    return future
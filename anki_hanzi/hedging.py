@@ -0,0 +1,162 @@
+import logging
+import queue
+import statistics
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Any, Callable, Protocol, TypeVar
+
+import grpc  # type: ignore
+from google.api_core.exceptions import DeadlineExceeded, from_grpc_error
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+T_co = TypeVar("T_co", covariant=True)
+
+
+class Attempt(Protocol[T_co]):
+    """A request in flight that can be cancelled, e.g. the grpc.Future returned by a unary call's future()."""
+
+    def result(self) -> T_co: ...
+
+    def exception(self) -> BaseException | None: ...
+
+    def cancel(self) -> bool: ...
+
+    def cancelled(self) -> bool: ...
+
+    def add_done_callback(self, fn: Callable[[Any], None]) -> None: ...
+
+
+class HedgedCaller:
+    """Run remote calls with a deadline and optionally hedge slow ones.
+
+    If hedging is enabled and a call has not returned after the hedge_percentile of the latencies observed so far, a
+    duplicate request is sent and whichever returns first wins. The other one is cancelled. The number of duplicate
+    requests is capped at max_hedge_ratio of all calls so that a slow backend does not end up with twice the load.
+    """
+
+    _deadline: float
+    _hedge: bool
+    _hedge_percentile: int
+    _max_hedge_ratio: float
+    _min_samples: int
+    _samples: deque[float]
+    _lock: threading.Lock
+    calls: int
+    hedges: int
+    latencies: list[float]
+
+    def __init__(
+        self,
+        deadline: timedelta = timedelta(seconds=30),
+        hedge: bool = False,
+        hedge_percentile: int = 95,
+        max_hedge_ratio: float = 0.1,
+        min_samples: int = 20,
+        window: int = 200,
+    ):
+        self._deadline = deadline.total_seconds()
+        self._hedge = hedge
+        self._hedge_percentile = hedge_percentile
+        self._max_hedge_ratio = max_hedge_ratio
+        self._min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges = 0
+        # Latencies as seen by the caller, i.e. including the benefit of hedging.
+        self.latencies = []
+
+    def _hedge_delay(self) -> float | None:
+        """Return how long to wait before hedging or None if no hedge should be sent."""
+        with self._lock:
+            if not self._hedge or len(self._samples) < self._min_samples:
+                return None
+            quantiles = statistics.quantiles(self._samples, n=100, method="inclusive")
+            return quantiles[self._hedge_percentile - 1]
+
+    def _start(
+        self,
+        start_attempt: Callable[[float], Attempt[T]],
+        deadline_at: float,
+        finished: "queue.SimpleQueue[Attempt[T]]",
+    ) -> Attempt[T]:
+        start = time.monotonic()
+        attempt = start_attempt(deadline_at - start)
+
+        def done(attempt: Attempt[T]) -> None:
+            if attempt.cancelled():
+                return
+            if attempt.exception() is None:
+                with self._lock:
+                    self._samples.append(time.monotonic() - start)
+            finished.put(attempt)
+
+        attempt.add_done_callback(done)
+        return attempt
+
+    def call(self, start_attempt: Callable[[float], Attempt[T]]) -> T:
+        """Start an attempt with the remaining time in seconds until the deadline and return the first result.
+
+        Attempts still in flight when call() returns or raises are cancelled.
+        """
+        start = time.monotonic()
+        deadline_at = start + self._deadline
+        with self._lock:
+            self.calls += 1
+        hedge_delay = self._hedge_delay()
+        hedge_at = None if hedge_delay is None else start + hedge_delay
+
+        finished: queue.SimpleQueue[Attempt[T]] = queue.SimpleQueue()
+        attempts = [self._start(start_attempt, deadline_at, finished)]
+        error: BaseException | None = None
+        try:
+            while attempts:
+                wake_at = (
+                    deadline_at if hedge_at is None else min(hedge_at, deadline_at)
+                )
+                try:
+                    attempt = finished.get(timeout=max(wake_at - time.monotonic(), 0))
+                except queue.Empty:
+                    if hedge_at is None or time.monotonic() >= deadline_at:
+                        break
+                    hedge_at = None
+                    if self._reserve_hedge():
+                        logger.debug(
+                            f"No response after {hedge_delay:.3f} s. Hedging request."
+                        )
+                        attempts.append(
+                            self._start(start_attempt, deadline_at, finished)
+                        )
+                    continue
+
+                attempts.remove(attempt)
+                error = attempt.exception()
+                if error is None:
+                    with self._lock:
+                        self.latencies.append(time.monotonic() - start)
+                    return attempt.result()
+        finally:
+            # Do not leave the losing request running, it would only keep a connection busy.
+            for attempt in attempts:
+                attempt.cancel()
+
+        if error is not None:
+            # All requests failed before the deadline. Surface the error of the last one.
+            if isinstance(error, grpc.RpcError):
+                raise from_grpc_error(error) from error  # type: ignore[no-untyped-call]
+            raise error
+        # Use the same exception gRPC raises when its own timeout fires first, so callers only need to handle one.
+        raise DeadlineExceeded(  # type: ignore[no-untyped-call]
+            f"No response within deadline of {self._deadline} s"
+        )
+
+    def _reserve_hedge(self) -> bool:
+        with self._lock:
+            if self.hedges + 1 > self._max_hedge_ratio * self.calls:
+                return False
+            self.hedges += 1
+            return True
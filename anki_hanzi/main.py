@@ -1,11 +1,19 @@
 import logging
 import os
 from argparse import ArgumentParser
+from datetime import timedelta
 from pathlib import Path
 from typing import TypedDict
 
 from anki_hanzi import google_cloud
-from anki_hanzi.anki_client import AnkiClient, AnkiClientImpl
+from anki_hanzi.anki_client import (
+    ANKIWEB_SYNC_ENDPOINT,
+    AnkiClient,
+    AnkiClientImpl,
+    SyncAuthCache,
+)
+from anki_hanzi.compaction import CompactionStats, compact_media
+from anki_hanzi.hedging import HedgedCaller
 from anki_hanzi.processing import process_chinese_vocabulary_note
 from anki_hanzi.text_to_speech import (
     GoogleTextToSpeechSynthesizer,
@@ -16,14 +24,31 @@ from anki_hanzi.translation import GoogleTranslator, Translator
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-parser = ArgumentParser()
-parser.add_argument(
+# Arguments shared by all commands that talk to the Anki sync server
+anki_parser = ArgumentParser(add_help=False)
+anki_parser.add_argument(
     "--anki-credentials",
     dest="anki_credentials",
     type=Path,
     default=Path.home() / ".config/anki-hanzi/anki-credentials.txt",
     help="Text file containing Anki sync server username on first line and password on second line",
 )
+anki_parser.add_argument(
+    "--anki-auth-cache",
+    dest="anki_auth_cache",
+    type=Path,
+    default=Path.home() / ".cache/anki-hanzi/anki-sync-auth.json",
+    help="File in which the Anki sync token is cached so that later runs do not need to log in again",
+)
+anki_parser.add_argument(
+    "--no-anki-auth-cache",
+    dest="anki_auth_cache",
+    action="store_const",
+    const=None,
+    help="Log in to the Anki sync server on every run instead of caching the sync token",
+)
+
+parser = ArgumentParser(parents=[anki_parser])
 google_application_credentials_default_path = (
     Path.home() / ".config/anki-hanzi/google-application-credentials.json"
 )
@@ -44,6 +69,19 @@ parser.add_argument(
     action="store_true",
     help="Overwrite target fields even if they have a non-empty value already",
 )
+parser.add_argument(
+    "--google-deadline",
+    dest="google_deadline",
+    type=float,
+    default=30.0,
+    help="Deadline in seconds for each Google Cloud translation or text-to-speech call",
+)
+parser.add_argument(
+    "--hedge-google-requests",
+    dest="hedge_google_requests",
+    action="store_true",
+    help="Send a duplicate Google Cloud request if a call is unusually slow and use whichever returns first",
+)
 parser.add_argument(
     "anki_collection_path",
     type=Path,
@@ -55,6 +93,29 @@ parser.add_argument(
     help="Name of the deck to process",
 )
 
+compact_media_parser = ArgumentParser(
+    parents=[anki_parser],
+    description="Trash generated audio that no note references and merge byte-identical duplicates.",
+)
+compact_media_parser.add_argument(
+    "--dry-run",
+    dest="dry_run",
+    action="store_true",
+    help="Only report what would be done without changing the collection",
+)
+compact_media_parser.add_argument(
+    "--include-unrecorded-mp3",
+    dest="include_unrecorded_mp3",
+    action="store_true",
+    help="Also trash unreferenced mp3 files that anki-hanzi has no record of generating, e.g. those left behind by "
+    "versions before it kept track of them. This includes mp3 files added by other means. Check with --dry-run first",
+)
+compact_media_parser.add_argument(
+    "anki_collection_path",
+    type=Path,
+    help="Location where the local Anki collection is stored",
+)
+
 
 class ProcessingStats(TypedDict):
     total: int
@@ -114,10 +175,30 @@ def run(
     google_cloud_project_id: str,
     force: bool,
     overwrite_target_fields: bool,
+    anki_endpoint: str = ANKIWEB_SYNC_ENDPOINT,
+    translator: Translator | None = None,
+    tts_synthesizer: TextToSpeechSynthesizer | None = None,
+    google_deadline: timedelta = timedelta(seconds=30),
+    hedge_google_requests: bool = False,
+    anki_auth_cache_path: Path | None = None,
 ) -> ProcessingStats:
-    anki = AnkiClientImpl(anki_collection_path, anki_username, anki_password)
-    translator = GoogleTranslator(google_cloud_project_id)
-    tts_synthesizer = GoogleTextToSpeechSynthesizer()
+    auth_cache = SyncAuthCache(anki_auth_cache_path) if anki_auth_cache_path else None
+    anki = AnkiClientImpl(
+        anki_collection_path,
+        anki_username,
+        anki_password,
+        endpoint=anki_endpoint,
+        auth_cache=auth_cache,
+    )
+    if translator is None:
+        translator = GoogleTranslator(
+            google_cloud_project_id,
+            hedged_caller=HedgedCaller(google_deadline, hedge_google_requests),
+        )
+    if tts_synthesizer is None:
+        tts_synthesizer = GoogleTextToSpeechSynthesizer(
+            hedged_caller=HedgedCaller(google_deadline, hedge_google_requests)
+        )
 
     anki.sync()
 
@@ -164,6 +245,58 @@ def main() -> None:
         google_cloud_project_id,
         args.force,
         args.overwrite_target_fields,
+        google_deadline=timedelta(seconds=args.google_deadline),
+        hedge_google_requests=args.hedge_google_requests,
+        anki_auth_cache_path=args.anki_auth_cache,
+    )
+
+
+def run_compact_media(
+    anki_username: str,
+    anki_password: str,
+    anki_collection_path: Path,
+    dry_run: bool,
+    include_unrecorded_mp3: bool = False,
+    anki_endpoint: str = ANKIWEB_SYNC_ENDPOINT,
+    anki_auth_cache_path: Path | None = None,
+) -> CompactionStats:
+    auth_cache = SyncAuthCache(anki_auth_cache_path) if anki_auth_cache_path else None
+    anki = AnkiClientImpl(
+        anki_collection_path,
+        anki_username,
+        anki_password,
+        endpoint=anki_endpoint,
+        auth_cache=auth_cache,
+    )
+
+    anki.sync()
+
+    stats = compact_media(
+        anki, dry_run=dry_run, include_unrecorded_mp3=include_unrecorded_mp3
+    )
+
+    if not dry_run:
+        anki.sync()
+
+    logger.info(
+        f"{'Would reclaim' if dry_run else 'Reclaimed'} {stats['bytes_reclaimed']} bytes: "
+        f"{stats['orphaned_files']} orphaned and {stats['duplicate_files']} duplicate files, "
+        f"{stats['rewritten_notes']} notes rewritten."
+    )
+    return stats
+
+
+def compact_media_main() -> None:
+    args = compact_media_parser.parse_args()
+    anki_username, anki_password = parse_anki_credentials(args.anki_credentials)
+
+    run_compact_media(
+        anki_username,
+        anki_password,
+        args.anki_collection_path,
+        args.dry_run,
+        include_unrecorded_mp3=args.include_unrecorded_mp3,
+        anki_auth_cache_path=args.anki_auth_cache,
     )
 
 
@@ -13,6 +13,12 @@ from anki_hanzi.translation import Translator
 
 ANKI_HANZI_TAG = "anki-hanzi"
 
+# Fields holding audio generated by synthesize(), mapped to the fields whose text is synthesized into them.
+GENERATED_SPEECH_FIELDS = {
+    "Generated Speech": "Word (Character)",
+    "Example Sentence - Generated  Speech": "Example Sentence - Characters",
+}
+
 
 def make_media_file_name(stem: str, extension: str) -> str:
     stem = stem.strip().replace("?", "").replace("/", "")
@@ -69,6 +75,8 @@ def synthesize(
 
     mp3 = synthesizer.synthesize_mp3(text, language)
     anki.add_media_file(file_name, mp3)
+    # Remember the file even after no note references it anymore, so that compaction can clean it up.
+    anki.register_generated_media_files([file_name])
     return result
 
 
@@ -217,16 +225,12 @@ def process_chinese_vocabulary_note(
         target_field="Example Sentence - Zhuyin",
         transformation_function=to_zhuyin,
     )
-    modified |= transform(
-        source_field="Word (Character)",
-        target_field="Generated Speech",
-        transformation_function=synthesize_simplified,
-    )
-    modified |= transform(
-        source_field="Example Sentence - Characters",
-        target_field="Example Sentence - Generated  Speech",
-        transformation_function=synthesize_simplified,
-    )
+    for target_field, source_field in GENERATED_SPEECH_FIELDS.items():
+        modified |= transform(
+            source_field=source_field,
+            target_field=target_field,
+            transformation_function=synthesize_simplified,
+        )
     modified |= transform(
         source_field="Word (Character)",
         target_field="Word (Tone numbers)",
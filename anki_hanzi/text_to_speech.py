@@ -3,7 +3,11 @@ from typing import Protocol
 
 from google.cloud import texttospeech as googletts
 
-from anki_hanzi.google_cloud import language_to_google_language_code
+from anki_hanzi.google_cloud import (
+    language_to_google_language_code,
+    start_unary_call,
+)
+from anki_hanzi.hedging import HedgedCaller
 from anki_hanzi.language import Language
 
 
@@ -13,9 +17,15 @@ class TextToSpeechSynthesizer(Protocol):
 
 class GoogleTextToSpeechSynthesizer(TextToSpeechSynthesizer):
     _client: googletts.TextToSpeechClient
+    _hedged_caller: HedgedCaller
 
-    def __init__(self) -> None:
-        self._client = googletts.TextToSpeechClient()
+    def __init__(
+        self,
+        client: googletts.TextToSpeechClient | None = None,
+        hedged_caller: HedgedCaller | None = None,
+    ) -> None:
+        self._client = client or googletts.TextToSpeechClient()
+        self._hedged_caller = hedged_caller or HedgedCaller()
 
     @staticmethod
     def _language_code_to_voice_name(language_code: str) -> str:
@@ -44,12 +54,17 @@ class GoogleTextToSpeechSynthesizer(TextToSpeechSynthesizer):
         )
 
     def synthesize_mp3(self, text: str, language: Language) -> bytes:
-        text_input = googletts.SynthesisInput(text=text)
-        response = self._client.synthesize_speech(
-            input=text_input,
+        # Pick the voice once so that a hedged duplicate request asks for the same audio.
+        request = googletts.SynthesizeSpeechRequest(
+            input=googletts.SynthesisInput(text=text),
             voice=GoogleTextToSpeechSynthesizer._get_voice(language),
             audio_config=googletts.AudioConfig(
                 audio_encoding=googletts.AudioEncoding.MP3,
             ),
         )
+        response: googletts.SynthesizeSpeechResponse = self._hedged_caller.call(
+            lambda timeout: start_unary_call(
+                self._client.transport.synthesize_speech, request, timeout
+            )
+        )
         return response.audio_content
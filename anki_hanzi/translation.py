@@ -2,7 +2,11 @@ from typing import Protocol
 
 from google.cloud import translate_v3
 
-from anki_hanzi.google_cloud import language_to_google_language_code
+from anki_hanzi.google_cloud import (
+    language_to_google_language_code,
+    start_unary_call,
+)
+from anki_hanzi.hedging import HedgedCaller
 from anki_hanzi.language import Language
 
 
@@ -15,18 +19,34 @@ class Translator(Protocol):
 class GoogleTranslator(Translator):
     _client: translate_v3.TranslationServiceClient
     _project_id: str
-
-    def __init__(self, project_id: str):
+    _hedged_caller: HedgedCaller
+
+    def __init__(
+        self,
+        project_id: str,
+        client: translate_v3.TranslationServiceClient | None = None,
+        hedged_caller: HedgedCaller | None = None,
+    ):
         self._project_id = project_id
-        self._client = translate_v3.TranslationServiceClient()
+        self._client = client or translate_v3.TranslationServiceClient()
+        self._hedged_caller = hedged_caller or HedgedCaller()
 
     def translate(
         self, text: str, source_language: Language, target_language: Language
     ) -> str:
-        result = self._client.translate_text(
-            parent=f"projects/{self._project_id}",
+        parent = f"projects/{self._project_id}"
+        request = translate_v3.TranslateTextRequest(
+            parent=parent,
             contents=[text],
             source_language_code=language_to_google_language_code(source_language),
             target_language_code=language_to_google_language_code(target_language),
         )
+        result: translate_v3.TranslateTextResponse = self._hedged_caller.call(
+            lambda timeout: start_unary_call(
+                self._client.transport.translate_text,
+                request,
+                timeout,
+                routing=(("parent", parent),),
+            )
+        )
         return result.translations[0].translated_text
@@ -0,0 +1,63 @@
+"""Run the sync server that ships with the anki package as a local subprocess."""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+class SyncServerNotReadyException(Exception):
+    pass
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port: int = s.getsockname()[1]
+        return port
+
+
+def _wait_until_listening(port: int, process: subprocess.Popen[bytes]) -> None:
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SyncServerNotReadyException(
+                f"Sync server exited with code {process.returncode}"
+            )
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise SyncServerNotReadyException(f"Sync server not listening on port {port}")
+
+
+@contextmanager
+def local_sync_server(base: Path, username: str, password: str) -> Iterator[str]:
+    """Start a sync server storing its data under base and yield its endpoint."""
+    base.mkdir(parents=True, exist_ok=True)
+    port = _free_port()
+    env = {
+        **os.environ,
+        "SYNC_USER1": f"{username}:{password}",
+        "SYNC_BASE": str(base),
+        "SYNC_HOST": "127.0.0.1",
+        "SYNC_PORT": str(port),
+    }
+    with open(base.parent / "sync-server.log", "wb") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "anki.syncserver"],
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        try:
+            _wait_until_listening(port, process)
+            yield f"http://127.0.0.1:{port}/"
+        finally:
+            process.terminate()
+            process.wait()
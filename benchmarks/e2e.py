@@ -0,0 +1,388 @@
+"""End-to-end benchmark of run() against a local Anki sync server and fake Google services.
+
+Nothing leaves the machine: the sync server shipped with the anki package stores its data in a temporary directory and
+translation and text-to-speech requests go to local gRPC servers with configurable latency, errors and quotas.
+"""
+
+import functools
+import logging
+import statistics
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser, Namespace
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from anki.collection import Collection
+
+from anki_hanzi.anki_client import AnkiClientImpl, suppress_stdout
+from anki_hanzi.hedging import HedgedCaller
+from anki_hanzi.main import ProcessingStats, run
+from anki_hanzi.text_to_speech import GoogleTextToSpeechSynthesizer
+from anki_hanzi.translation import GoogleTranslator
+from benchmarks import fake_google
+from benchmarks.anki_sync_server import local_sync_server
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+USERNAME = "anki-hanzi"
+PASSWORD = "benchmark"
+PROJECT_ID = "anki-hanzi-benchmark"
+NOTETYPE_NAME = "Chinese Vocabulary (anki-hanzi benchmark)"
+NOTETYPE_FIELDS = [
+    "Word (Character)",
+    "Word (Traditional Character)",
+    "Word (Pinyin)",
+    "Word (Zhuyin)",
+    "Word (Tone numbers)",
+    "Generated Speech",
+    "Example Sentence - Characters",
+    "Example Sentence - Traditional Characters",
+    "Example Sentence - English",
+    "Example Sentence - Pinyin",
+    "Example Sentence - Zhuyin",
+    "Example Sentence - Generated  Speech",
+]
+WORDS = ["你好", "谢谢", "学习", "中文", "朋友", "老师", "今天", "喜欢", "吃饭", "电脑"]
+
+parser = ArgumentParser(description=__doc__)
+parser.add_argument("--notes", type=int, default=100, help="Number of seeded notes")
+parser.add_argument(
+    "--seed-media-files",
+    dest="seed_media_files",
+    type=int,
+    default=0,
+    help="Number of media files in the seeded collection, downloaded during the initial sync",
+)
+parser.add_argument(
+    "--seed-media-size",
+    dest="seed_media_size",
+    type=int,
+    default=20_000,
+    help="Size of each seeded media file in bytes",
+)
+parser.add_argument(
+    "--audio-size",
+    dest="audio_size",
+    type=int,
+    default=20_000,
+    help="Size of each synthesized mp3 in bytes",
+)
+parser.add_argument(
+    "--latency-ms",
+    dest="latency_ms",
+    type=float,
+    default=50,
+    help="Latency of a regular Google call",
+)
+parser.add_argument(
+    "--tail-latency-ms",
+    dest="tail_latency_ms",
+    type=float,
+    default=2000,
+    help="Latency of a slow Google call",
+)
+parser.add_argument(
+    "--tail-probability",
+    dest="tail_probability",
+    type=float,
+    default=0.0,
+    help="Probability that a Google call takes --tail-latency-ms",
+)
+parser.add_argument(
+    "--error-rate",
+    dest="error_rate",
+    type=float,
+    default=0.0,
+    help="Probability that a Google call fails with UNAVAILABLE",
+)
+parser.add_argument(
+    "--quota",
+    type=int,
+    default=None,
+    help="Calls per Google service after which every call fails with RESOURCE_EXHAUSTED",
+)
+parser.add_argument(
+    "--google-deadline",
+    dest="google_deadline",
+    type=float,
+    default=30.0,
+    help="Deadline in seconds for each Google call",
+)
+parser.add_argument(
+    "--hedge-google-requests",
+    dest="hedge_google_requests",
+    action="store_true",
+    help="Hedge slow Google calls",
+)
+parser.add_argument(
+    "--work-dir",
+    dest="work_dir",
+    type=Path,
+    default=None,
+    help="Keep collections and sync server data in this directory instead of a temporary one. Must be empty or not exist.",
+)
+
+
+def seed_collection(
+    collection_path: Path,
+    endpoint: str,
+    deck_name: str,
+    notes: int,
+    media_files: int,
+    media_size: int,
+) -> None:
+    """Create a collection with unprocessed notes and upload it to the sync server."""
+    collection_path.parent.mkdir(parents=True)
+    collection = Collection(path=str(collection_path))
+
+    models = collection.models
+    notetype = models.new(NOTETYPE_NAME)
+    for field_name in NOTETYPE_FIELDS:
+        models.add_field(notetype, models.new_field(field_name))
+    template = models.new_template("Card 1")
+    template["qfmt"] = "{{Word (Character)}}"
+    template["afmt"] = "{{FrontSide}}<hr id=answer>{{Word (Pinyin)}}"
+    models.add_template(notetype, template)
+    models.add(notetype)
+    added_notetype = models.by_name(NOTETYPE_NAME)
+    assert added_notetype is not None
+
+    deck_id = collection.decks.id(deck_name)
+    assert deck_id is not None
+    for i in range(notes):
+        note = collection.new_note(added_notetype)
+        word = WORDS[i % len(WORDS)]
+        # Make each note unique so that each one results in its own media files.
+        note["Word (Character)"] = f"{word}{i}"
+        note["Example Sentence - Characters"] = f"我{i}次说{word}。"
+        collection.add_note(note, deck_id)
+
+    for i in range(media_files):
+        collection.media.write_data(
+            f"seed-{i}.bin", i.to_bytes(8, "big") * (media_size // 8)
+        )
+
+    with suppress_stdout():
+        auth = collection.sync_login(
+            username=USERNAME, password=PASSWORD, endpoint=endpoint
+        )
+        collection.sync_collection(auth=auth, sync_media=False)
+        collection.close_for_full_sync()
+        collection.full_upload_or_download(auth=auth, server_usn=None, upload=True)
+        collection.reopen(after_full_sync=True)
+        collection.sync_media(auth)
+    while collection.media_sync_status().active:
+        time.sleep(0.1)
+    collection.close()
+
+
+@contextmanager
+def timed(cls: type, method_name: str, durations: list[float]) -> Iterator[None]:
+    """Record the duration of every call of cls.method_name in durations."""
+    original: Callable[..., Any] = getattr(cls, method_name)
+
+    @functools.wraps(original)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            durations.append(time.perf_counter() - start)
+
+    setattr(cls, method_name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(cls, method_name, original)
+
+
+@contextmanager
+def timed_media_sync(durations: list[float]) -> Iterator[None]:
+    """Record for how long media was syncing during each call of AnkiClientImpl.sync().
+
+    AnkiClientImpl.wait_for_media_sync() cannot be used for this. It retries with exponential backoff, so its duration
+    is always a multiple of the backoff rather than the actual time the media sync took. Instead, poll the media sync
+    status at a fine interval for the whole sync. The media sync may start at different points during the sync, e.g.
+    only after a full download has completed.
+    """
+    original = AnkiClientImpl.sync
+
+    def poll(collection: Collection, done: threading.Event) -> None:
+        active = 0.0
+        last = time.perf_counter()
+        while not done.wait(0.005):
+            now = time.perf_counter()
+            if collection.media_sync_status().active:
+                active += now - last
+            last = now
+        durations.append(active)
+
+    @functools.wraps(original)
+    def wrapper(self: AnkiClientImpl) -> None:
+        done = threading.Event()
+        monitor = threading.Thread(target=poll, args=(self._collection, done))
+        monitor.start()
+        try:
+            original(self)
+        finally:
+            done.set()
+            monitor.join()
+
+    setattr(AnkiClientImpl, "sync", wrapper)
+    try:
+        yield
+    finally:
+        setattr(AnkiClientImpl, "sync", original)
+
+
+def percentile(values: list[float], p: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+def throughput(num_bytes: int, seconds: float) -> str:
+    if seconds <= 0:
+        return "n/a"
+    return f"{num_bytes / seconds / 1_000_000:.2f} MB/s"
+
+
+def log_service_stats(
+    name: str, stats: fake_google.FakeServiceStats, hedged_caller: HedgedCaller
+) -> None:
+    """Log the latencies seen by the client next to those of the individual requests.
+
+    The latencies of the individual requests are what the client would have seen without hedging, so the difference is
+    what hedging gained. They include failed requests, the client's latencies only successful calls.
+    """
+    latencies = []
+    for p in [50, 99]:
+        service = percentile(stats.latencies, p) * 1000
+        client = percentile(hedged_caller.latencies, p) * 1000
+        latencies.append(
+            f"p{p} {service:.0f} ms per request, {client:.0f} ms for the client ({client - service:+.0f} ms)"
+        )
+    summary = (
+        f"{stats.calls} requests, {stats.errors} errors, {hedged_caller.hedges} hedged"
+    )
+    logger.info(f"{name}: {summary}, {', '.join(latencies)}")
+
+
+def benchmark(args: Namespace, work_dir: Path) -> None:
+    deck_name = "anki-hanzi-benchmark"
+    behaviour = fake_google.FakeServiceBehaviour(
+        latency=args.latency_ms / 1000,
+        tail_latency=args.tail_latency_ms / 1000,
+        tail_probability=args.tail_probability,
+        error_rate=args.error_rate,
+        quota=args.quota,
+    )
+    translation_service = fake_google.FakeTranslationService(behaviour)
+    tts_service = fake_google.FakeTextToSpeechService(
+        behaviour, audio_size=args.audio_size
+    )
+
+    with (
+        local_sync_server(work_dir / "server", USERNAME, PASSWORD) as endpoint,
+        fake_google.serve(translation_service.handler()) as translation_address,
+        fake_google.serve(tts_service.handler()) as tts_address,
+    ):
+        seed_start = time.perf_counter()
+        seed_collection(
+            work_dir / "seed" / "collection.anki2",
+            endpoint,
+            deck_name,
+            notes=args.notes,
+            media_files=args.seed_media_files,
+            media_size=args.seed_media_size,
+        )
+        logger.info(f"Seeded collection in {time.perf_counter() - seed_start:.2f} s")
+
+        deadline = timedelta(seconds=args.google_deadline)
+        translation_caller = HedgedCaller(deadline, args.hedge_google_requests)
+        tts_caller = HedgedCaller(deadline, args.hedge_google_requests)
+        translator = GoogleTranslator(
+            PROJECT_ID,
+            client=fake_google.translation_client(translation_address),
+            hedged_caller=translation_caller,
+        )
+        tts_synthesizer = GoogleTextToSpeechSynthesizer(
+            client=fake_google.text_to_speech_client(tts_address),
+            hedged_caller=tts_caller,
+        )
+
+        client_collection_path = work_dir / "client" / "collection.anki2"
+        client_collection_path.parent.mkdir(parents=True)
+
+        sync_durations: list[float] = []
+        media_sync_durations: list[float] = []
+        stats: ProcessingStats | None = None
+        with (
+            timed(AnkiClientImpl, "sync", sync_durations),
+            timed_media_sync(media_sync_durations),
+        ):
+            start = time.perf_counter()
+            try:
+                stats = run(
+                    anki_username=USERNAME,
+                    anki_password=PASSWORD,
+                    anki_collection_path=client_collection_path,
+                    deck_name=deck_name,
+                    google_cloud_project_id=PROJECT_ID,
+                    force=False,
+                    overwrite_target_fields=False,
+                    anki_endpoint=endpoint,
+                    translator=translator,
+                    tts_synthesizer=tts_synthesizer,
+                )
+            except Exception:
+                # Injected errors and exhausted quotas are expected to abort run(), still report what happened so far.
+                logger.exception("run() failed, reporting partial results")
+            total = time.perf_counter() - start
+
+    if stats is not None:
+        logger.info(f"Notes: {stats['modified']} / {stats['total']} modified")
+    logger.info(f"Total wall time: {total:.2f} s")
+    logger.info(f"Processing (excluding syncs): {total - sum(sync_durations):.2f} s")
+
+    # run() syncs twice: the initial sync is a full download, the final one uploads the changes and generated audio.
+    # If run() failed, there may be fewer.
+    seeded_bytes = args.seed_media_files * args.seed_media_size
+    # Not the bytes served by the TTS service, those include the responses of hedged duplicates that were discarded.
+    generated_bytes = sum(
+        path.stat().st_size
+        for path in (client_collection_path.parent / "collection.media").glob("*.mp3")
+    )
+    for name, sync_duration, media_sync_duration, media_bytes in zip(
+        ["Initial sync", "Final sync"],
+        sync_durations,
+        media_sync_durations,
+        [seeded_bytes, generated_bytes],
+    ):
+        logger.info(
+            f"{name}: {sync_duration:.2f} s, media sync: {media_sync_duration:.2f} s "
+            f"({media_bytes} bytes, {throughput(media_bytes, media_sync_duration)})"
+        )
+    log_service_stats("Translate", translation_service.stats, translation_caller)
+    log_service_stats("TextToSpeech", tts_service.stats, tts_caller)
+
+
+def main() -> None:
+    args = parser.parse_args()
+    if args.work_dir is not None:
+        if args.work_dir.exists() and any(args.work_dir.iterdir()):
+            parser.error(f"--work-dir {args.work_dir} is not empty")
+        args.work_dir.mkdir(parents=True, exist_ok=True)
+        benchmark(args, args.work_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="anki-hanzi-benchmark-") as work_dir:
+            benchmark(args, Path(work_dir))
+
+
+if __name__ == "__main__":
+    main()
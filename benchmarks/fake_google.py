@@ -0,0 +1,175 @@
+"""Local gRPC stand-ins for the Google Cloud Translate v3 and TextToSpeech services."""
+
+import hashlib
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterator
+
+import grpc  # type: ignore
+from google.cloud import texttospeech as googletts
+from google.cloud import translate_v3
+from google.cloud.texttospeech_v1.services.text_to_speech.transports import (
+    TextToSpeechGrpcTransport,
+)
+from google.cloud.translate_v3.services.translation_service.transports import (
+    TranslationServiceGrpcTransport,
+)
+
+
+@dataclass
+class FakeServiceBehaviour:
+    """How a fake service responds. Latencies are in seconds."""
+
+    latency: float = 0.0
+    # With probability tail_probability a call takes tail_latency instead of latency.
+    tail_latency: float = 0.0
+    tail_probability: float = 0.0
+    # Probability that a call fails with UNAVAILABLE.
+    error_rate: float = 0.0
+    # Number of calls after which every call fails with RESOURCE_EXHAUSTED. None means unlimited.
+    quota: int | None = None
+
+
+@dataclass
+class FakeServiceStats:
+    calls: int = 0
+    errors: int = 0
+    bytes_served: int = 0
+    # Simulated latency of every request, including hedged duplicates.
+    latencies: list[float] = field(default_factory=list)
+
+
+class FakeService:
+    """Applies a FakeServiceBehaviour to every call and keeps track of what happened."""
+
+    _behaviour: FakeServiceBehaviour
+    _random: random.Random
+    _lock: threading.Lock
+    stats: FakeServiceStats
+
+    def __init__(self, behaviour: FakeServiceBehaviour, seed: int = 0):
+        self._behaviour = behaviour
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = FakeServiceStats()
+
+    def _admit(self, context: Any) -> None:
+        """Simulate latency, errors and quotas. Aborts the call via context if it should fail."""
+        with self._lock:
+            self.stats.calls += 1
+            quota = self._behaviour.quota
+            over_quota = quota is not None and self.stats.calls > quota
+            failed = self._random.random() < self._behaviour.error_rate
+            in_tail = self._random.random() < self._behaviour.tail_probability
+            if over_quota or failed:
+                self.stats.errors += 1
+
+        latency = self._behaviour.tail_latency if in_tail else self._behaviour.latency
+        time.sleep(latency)
+
+        with self._lock:
+            self.stats.latencies.append(latency)
+
+        if over_quota:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, "Quota exceeded")
+        if failed:
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Injected failure")
+
+    def _served(self, num_bytes: int) -> None:
+        with self._lock:
+            self.stats.bytes_served += num_bytes
+
+
+class FakeTranslationService(FakeService):
+    def translate_text(
+        self, request: translate_v3.TranslateTextRequest, context: Any
+    ) -> translate_v3.TranslateTextResponse:
+        self._admit(context)
+        translations = []
+        for text in request.contents:
+            if request.target_language_code.startswith("zh"):
+                # Simplified and traditional characters are mostly the same, good enough for a benchmark.
+                translated_text = text
+            else:
+                translated_text = f"Translation of {text}"
+            translations.append(
+                translate_v3.Translation(translated_text=translated_text)
+            )
+            self._served(len(translated_text.encode("utf-8")))
+        return translate_v3.TranslateTextResponse(translations=translations)
+
+    def handler(self) -> Any:
+        return grpc.method_handlers_generic_handler(
+            "google.cloud.translation.v3.TranslationService",
+            {
+                "TranslateText": grpc.unary_unary_rpc_method_handler(
+                    self.translate_text,
+                    request_deserializer=translate_v3.TranslateTextRequest.deserialize,
+                    response_serializer=translate_v3.TranslateTextResponse.serialize,
+                ),
+            },
+        )
+
+
+class FakeTextToSpeechService(FakeService):
+    _audio_size: int
+
+    def __init__(self, behaviour: FakeServiceBehaviour, audio_size: int, seed: int = 0):
+        super().__init__(behaviour, seed)
+        self._audio_size = audio_size
+
+    def synthesize_speech(
+        self, request: googletts.SynthesizeSpeechRequest, context: Any
+    ) -> googletts.SynthesizeSpeechResponse:
+        self._admit(context)
+        # Derive the payload from the text so that different texts result in different files.
+        digest = hashlib.sha256(request.input.text.encode("utf-8")).digest()
+        repetitions = self._audio_size // len(digest) + 1
+        audio_content = (digest * repetitions)[: self._audio_size]
+        self._served(len(audio_content))
+        return googletts.SynthesizeSpeechResponse(audio_content=audio_content)
+
+    def handler(self) -> Any:
+        return grpc.method_handlers_generic_handler(
+            "google.cloud.texttospeech.v1.TextToSpeech",
+            {
+                "SynthesizeSpeech": grpc.unary_unary_rpc_method_handler(
+                    self.synthesize_speech,
+                    request_deserializer=googletts.SynthesizeSpeechRequest.deserialize,
+                    response_serializer=googletts.SynthesizeSpeechResponse.serialize,
+                ),
+            },
+        )
+
+
+@contextmanager
+def serve(handler: Any, max_workers: int = 16) -> Iterator[str]:
+    """Serve handler on a free local port and yield its address."""
+    server = grpc.server(ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    try:
+        yield f"127.0.0.1:{port}"
+    finally:
+        server.stop(grace=None)
+
+
+def _insecure_transport(transport_class: Callable[..., Any], address: str) -> Any:
+    return transport_class(channel=grpc.insecure_channel(address))
+
+
+def translation_client(address: str) -> translate_v3.TranslationServiceClient:
+    return translate_v3.TranslationServiceClient(
+        transport=_insecure_transport(TranslationServiceGrpcTransport, address)
+    )
+
+
+def text_to_speech_client(address: str) -> googletts.TextToSpeechClient:
+    return googletts.TextToSpeechClient(
+        transport=_insecure_transport(TextToSpeechGrpcTransport, address)
+    )
@@ -1,7 +1,7 @@
 import subprocess
 import sys
 
-SOURCES = ["anki_hanzi/", "tests/", "poetry_scripts.py"]
+SOURCES = ["anki_hanzi/", "benchmarks/", "tests/", "poetry_scripts.py"]
 
 
 def run(*cmd: str) -> None:
@@ -36,6 +36,19 @@ def mypy() -> None:
     run("poetry", "run", "mypy", *SOURCES)
 
 
+def test() -> None:
+    run(
+        "poetry",
+        "run",
+        "python",
+        "-m",
+        "unittest",
+        "discover",
+        "--start-directory",
+        "tests/",
+    )
+
+
 def lint() -> None:
     black_check()
     isort_check()
@@ -0,0 +1,202 @@
+import json
+import stat
+import tempfile
+from pathlib import Path
+from typing import Any
+from unittest import TestCase
+from unittest.mock import patch
+
+from anki.collection import Collection
+from anki.errors import SyncError, SyncErrorKind
+from anki.sync import SyncAuth, SyncOutput
+
+from anki_hanzi.anki_client import AnkiClientImpl, SyncAuthCache
+
+ENDPOINT = "https://sync.example.com/"
+
+
+class TemporaryDirectoryTestCase(TestCase):
+    directory: Path
+
+    def setUp(self) -> None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory = Path(temporary_directory.name)
+
+
+class TestSyncAuthCache(TemporaryDirectoryTestCase):
+    cache_path: Path
+    cache: SyncAuthCache
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.cache_path = self.directory / "cache" / "sync-auth.json"
+        self.cache = SyncAuthCache(self.cache_path)
+
+    def test_load_returns_none_without_cache_file(self) -> None:
+        self.assertIsNone(self.cache.load("user", ENDPOINT))
+
+    def test_store_and_load_round_trip(self) -> None:
+        self.cache.store("user", ENDPOINT, SyncAuth(hkey="key", endpoint="shard/"))
+
+        self.assertEqual(
+            self.cache.load("user", ENDPOINT), SyncAuth(hkey="key", endpoint="shard/")
+        )
+
+    def test_store_restricts_permissions(self) -> None:
+        self.cache.store("user", ENDPOINT, SyncAuth(hkey="key", endpoint=ENDPOINT))
+
+        self.assertEqual(stat.S_IMODE(self.cache_path.stat().st_mode), 0o600)
+        self.assertEqual(stat.S_IMODE(self.cache_path.parent.stat().st_mode), 0o700)
+
+    def test_store_overwrites_previous_entry(self) -> None:
+        self.cache.store("user", ENDPOINT, SyncAuth(hkey="old", endpoint=ENDPOINT))
+        self.cache.store("user", ENDPOINT, SyncAuth(hkey="new", endpoint=ENDPOINT))
+
+        auth = self.cache.load("user", ENDPOINT)
+        assert auth is not None
+        self.assertEqual(auth.hkey, "new")
+
+    def test_load_ignores_other_username(self) -> None:
+        self.cache.store("user", ENDPOINT, SyncAuth(hkey="key", endpoint=ENDPOINT))
+
+        self.assertIsNone(self.cache.load("other-user", ENDPOINT))
+
+    def test_load_ignores_other_endpoint(self) -> None:
+        self.cache.store("user", ENDPOINT, SyncAuth(hkey="key", endpoint=ENDPOINT))
+
+        self.assertIsNone(self.cache.load("user", "https://other.example.com/"))
+
+    def test_load_ignores_malformed_cache(self) -> None:
+        self.cache_path.parent.mkdir()
+        for content in [
+            "not json",
+            "[]",
+            "null",
+            json.dumps({"username": "user", "login_endpoint": ENDPOINT}),
+            json.dumps(
+                {
+                    "username": "user",
+                    "login_endpoint": ENDPOINT,
+                    "hkey": 1,
+                    "endpoint": ENDPOINT,
+                }
+            ),
+        ]:
+            with self.subTest(content=content):
+                self.cache_path.write_text(content)
+                with self.assertLogs("anki_hanzi.anki_client", "WARNING"):
+                    self.assertIsNone(self.cache.load("user", ENDPOINT))
+
+    def test_clear(self) -> None:
+        self.cache.store("user", ENDPOINT, SyncAuth(hkey="key", endpoint=ENDPOINT))
+        self.cache.clear()
+
+        self.assertFalse(self.cache_path.exists())
+        # Clearing twice is fine
+        self.cache.clear()
+
+    def test_unwritable_cache_is_ignored(self) -> None:
+        # A file where the cache directory should be. Unlike permissions, this also fails when running as root.
+        self.cache_path.parent.write_text("")
+
+        with self.assertLogs("anki_hanzi.anki_client", "WARNING"):
+            self.cache.store("user", ENDPOINT, SyncAuth(hkey="key", endpoint=ENDPOINT))
+        with self.assertLogs("anki_hanzi.anki_client", "WARNING"):
+            self.cache.clear()
+
+
+class FakeSyncServer:
+    """Stands in for the sync related Collection methods. Only accepts the hkey of the latest login."""
+
+    logins: int
+    synced_with: list[str]
+
+    def __init__(self) -> None:
+        self.logins = 0
+        self.synced_with = []
+
+    def sync_login(
+        self, collection: Collection, username: str, password: str, endpoint: str
+    ) -> SyncAuth:
+        self.logins += 1
+        return SyncAuth(hkey=f"hkey-{self.logins}", endpoint=endpoint)
+
+    def sync_collection(
+        self, collection: Collection, auth: SyncAuth, sync_media: bool
+    ) -> SyncOutput:
+        self.synced_with.append(auth.hkey)
+        if auth.hkey != f"hkey-{self.logins}":
+            raise SyncError("rejected", None, None, None, SyncErrorKind.AUTH)
+        return SyncOutput(required=SyncOutput.NO_CHANGES)
+
+
+class TestAnkiClientImplAuth(TemporaryDirectoryTestCase):
+    server: FakeSyncServer
+    cache: SyncAuthCache
+    clients: int
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.clients = 0
+        self.server = FakeSyncServer()
+        self.cache = SyncAuthCache(self.directory / "sync-auth.json")
+        for method in ["sync_login", "sync_collection"]:
+            patcher = patch.object(
+                Collection,
+                method,
+                autospec=True,
+                side_effect=getattr(self.server, method),
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def client(self, **kwargs: Any) -> AnkiClientImpl:
+        # Each client stands for a separate run. Give each its own collection as a collection can only be opened once.
+        self.clients += 1
+        collection_path = self.directory / f"collection-{self.clients}.anki2"
+        client = AnkiClientImpl(collection_path, "user", "password", ENDPOINT, **kwargs)
+        self.addCleanup(client._collection.close)
+        return client
+
+    def test_logs_in_on_every_run_without_cache(self) -> None:
+        self.client().sync()
+        self.client().sync()
+
+        self.assertEqual(self.server.logins, 2)
+
+    def test_reuses_cached_token(self) -> None:
+        self.client(auth_cache=self.cache).sync()
+        self.client(auth_cache=self.cache).sync()
+
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(self.server.synced_with, ["hkey-1", "hkey-1"])
+
+    def test_syncs_if_cache_cannot_be_written(self) -> None:
+        (self.directory / "not-a-directory").write_text("")
+        cache = SyncAuthCache(self.directory / "not-a-directory" / "sync-auth.json")
+
+        with self.assertLogs("anki_hanzi.anki_client", "WARNING"):
+            self.client(auth_cache=cache).sync()
+        self.assertEqual(self.server.synced_with, ["hkey-1"])
+
+    def test_logs_in_again_if_cached_token_is_rejected(self) -> None:
+        self.cache.store("user", ENDPOINT, SyncAuth(hkey="revoked", endpoint=ENDPOINT))
+
+        self.client(auth_cache=self.cache).sync()
+
+        self.assertEqual(self.server.logins, 1)
+        self.assertEqual(self.server.synced_with, ["revoked", "hkey-1"])
+        self.assertEqual(
+            self.cache.load("user", ENDPOINT),
+            SyncAuth(hkey="hkey-1", endpoint=ENDPOINT),
+        )
+
+    def test_rejection_without_cache_is_raised(self) -> None:
+        client = self.client()
+        # Invalidate the token obtained by the constructor
+        self.server.logins += 1
+
+        with self.assertRaises(SyncError):
+            client.sync()
+        self.assertEqual(self.server.logins, 2)
@@ -0,0 +1,326 @@
+import tempfile
+from collections import Counter
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+from anki.collection import Collection
+from anki.notes import Note
+from anki.sync import SyncAuth, SyncOutput
+
+from anki_hanzi.anki_client import AnkiClientImpl
+from anki_hanzi.compaction import _choose_canonical, compact_media
+from anki_hanzi.language import Language
+from anki_hanzi.main import run_compact_media
+from anki_hanzi.processing import ANKI_HANZI_TAG, synthesize
+
+ENDPOINT = "https://sync.example.com/"
+VOCABULARY_FIELDS = [
+    "Word (Character)",
+    "Generated Speech",
+    "Example Sentence - Characters",
+    "Example Sentence - Generated  Speech",
+]
+AUDIO = b"audio"
+OTHER_AUDIO = b"other audio"
+
+
+def fake_sync_login(
+    collection: Collection, username: str, password: str, endpoint: str
+) -> SyncAuth:
+    return SyncAuth(hkey="hkey", endpoint=endpoint)
+
+
+class CompactionTestCase(TestCase):
+    """Collection with processed vocabulary notes next to notes and media that have nothing to do with anki-hanzi."""
+
+    directory: Path
+    collection_path: Path
+    anki: AnkiClientImpl
+    collection: Collection
+    hello: Note
+    hello_again: Note
+    thanks: Note
+    study: Note
+    spanish: Note
+
+    def setUp(self) -> None:
+        temporary_directory = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_directory.cleanup)
+        self.directory = Path(temporary_directory.name)
+        self.collection_path = self.directory / "collection.anki2"
+
+        patcher = patch.object(
+            Collection, "sync_login", autospec=True, side_effect=fake_sync_login
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.anki = self.open_client()
+        self.collection = self.anki._collection
+
+        vocabulary = self.add_notetype("Vocabulary", VOCABULARY_FIELDS, "")
+        # Card template playing a file on its own
+        spanish = self.add_notetype("Spanish", ["Front", "Back"], "[sound:intro.mp3]")
+
+        self.hello = self.add_note(
+            vocabulary,
+            tagged=True,
+            **{"Word (Character)": "你好", "Generated Speech": "[sound:你好.mp3]"},
+        )
+        self.hello_again = self.add_note(
+            vocabulary,
+            tagged=True,
+            **{"Word (Character)": "你好", "Generated Speech": "[sound:你好.mp3]"},
+        )
+        # Byte-identical copy of 你好.mp3 under another name
+        self.thanks = self.add_note(
+            vocabulary,
+            tagged=True,
+            **{"Word (Character)": "谢谢", "Generated Speech": "[sound:谢谢.mp3]"},
+        )
+        # Generated speech has been removed, but the file named after the word still exists.
+        self.study = self.add_note(
+            vocabulary, tagged=True, **{"Word (Character)": "学习"}
+        )
+        self.spanish = self.add_note(
+            spanish,
+            tagged=False,
+            Front="hola",
+            Back='<audio src="hola.mp3"> [sound:b.mp3]',
+        )
+
+        for file_name, data in [
+            ("你好.mp3", AUDIO),
+            ("谢谢.mp3", AUDIO),
+            ("学习.mp3", OTHER_AUDIO),
+            ("replaced.mp3", OTHER_AUDIO),
+            ("unknown.mp3", OTHER_AUDIO),
+            ("_underscore.mp3", OTHER_AUDIO),
+            ("intro.mp3", OTHER_AUDIO),
+            ("hola.mp3", OTHER_AUDIO),
+            ("a.mp3", AUDIO),
+            ("b.mp3", AUDIO),
+        ]:
+            self.anki.add_media_file(file_name, data)
+
+        # Generated earlier but not referenced anymore
+        self.anki.register_generated_media_files(
+            ["replaced.mp3", "_underscore.mp3", "intro.mp3", "hola.mp3"]
+        )
+
+    def open_client(self) -> AnkiClientImpl:
+        anki = AnkiClientImpl(self.collection_path, "user", "password", ENDPOINT)
+        self.addCleanup(anki._collection.close)
+        return anki
+
+    def add_notetype(
+        self, name: str, fields: list[str], template_suffix: str
+    ) -> dict[str, object]:
+        models = self.collection.models
+        notetype = models.new(name)
+        for field_name in fields:
+            models.add_field(notetype, models.new_field(field_name))
+        template = models.new_template("Card 1")
+        template["qfmt"] = f"{{{{{fields[0]}}}}}{template_suffix}"
+        template["afmt"] = "{{FrontSide}}"
+        models.add_template(notetype, template)
+        models.add(notetype)
+        added = models.by_name(name)
+        assert added is not None
+        return added
+
+    def add_note(
+        self, notetype: dict[str, object], tagged: bool, **fields: str
+    ) -> Note:
+        note = self.collection.new_note(notetype)
+        for field_name, value in fields.items():
+            note[field_name] = value
+        if tagged:
+            note.add_tag(ANKI_HANZI_TAG)
+        deck_id = self.collection.decks.id("Default")
+        assert deck_id is not None
+        self.collection.add_note(note, deck_id)
+        return note
+
+    def field(self, note: Note, field_name: str) -> str:
+        return self.collection.get_note(note.id)[field_name]
+
+    def assertMediaFiles(self, expected: set[str]) -> None:
+        self.assertEqual(set(self.anki.media_files()), expected)
+
+
+class TestCompactMedia(CompactionTestCase):
+    def test_trashes_orphaned_generated_files(self) -> None:
+        stats = compact_media(self.anki)
+
+        self.assertEqual(stats["orphaned_files"], 2)
+        self.assertFalse(self.anki.media_file_exists("replaced.mp3"))
+        self.assertFalse(self.anki.media_file_exists("学习.mp3"))
+        # Neither generated by anki-hanzi nor named like it
+        self.assertTrue(self.anki.media_file_exists("unknown.mp3"))
+
+    def test_merges_duplicates_into_most_referenced_file(self) -> None:
+        stats = compact_media(self.anki)
+
+        self.assertEqual(stats["duplicate_files"], 1)
+        self.assertEqual(stats["rewritten_notes"], 1)
+        self.assertFalse(self.anki.media_file_exists("谢谢.mp3"))
+        self.assertEqual(
+            self.field(self.thanks, "Generated Speech"), "[sound:你好.mp3]"
+        )
+        self.assertEqual(self.field(self.hello, "Generated Speech"), "[sound:你好.mp3]")
+
+    def test_reports_reclaimed_bytes(self) -> None:
+        stats = compact_media(self.anki)
+
+        # replaced.mp3 and 学习.mp3 are orphaned, 谢谢.mp3 is a duplicate
+        self.assertEqual(stats["bytes_reclaimed"], 2 * len(OTHER_AUDIO) + len(AUDIO))
+
+    def test_preserves_files_not_owned_by_anki_hanzi(self) -> None:
+        compact_media(self.anki)
+
+        self.assertMediaFiles(
+            {
+                "你好.mp3",
+                "unknown.mp3",
+                "_underscore.mp3",
+                "intro.mp3",
+                "hola.mp3",
+                "a.mp3",
+                "b.mp3",
+            }
+        )
+        # a.mp3 and b.mp3 are identical, but b.mp3 belongs to a note not processed by anki-hanzi.
+        self.assertEqual(
+            self.field(self.spanish, "Back"), '<audio src="hola.mp3"> [sound:b.mp3]'
+        )
+
+    def test_include_unrecorded_mp3_trashes_any_unreferenced_mp3(self) -> None:
+        stats = compact_media(self.anki, include_unrecorded_mp3=True)
+
+        # unknown.mp3 and a.mp3 are not referenced anywhere
+        self.assertEqual(stats["orphaned_files"], 4)
+        self.assertMediaFiles(
+            {"你好.mp3", "_underscore.mp3", "intro.mp3", "hola.mp3", "b.mp3"}
+        )
+        self.assertEqual(
+            self.field(self.spanish, "Back"), '<audio src="hola.mp3"> [sound:b.mp3]'
+        )
+
+    def test_dry_run_changes_nothing(self) -> None:
+        media_files = set(self.anki.media_files())
+        generated_media_files = self.anki.generated_media_files()
+
+        stats = compact_media(self.anki, dry_run=True)
+
+        self.assertEqual(
+            stats,
+            {
+                "orphaned_files": 2,
+                "duplicate_files": 1,
+                "rewritten_notes": 1,
+                "bytes_reclaimed": 2 * len(OTHER_AUDIO) + len(AUDIO),
+            },
+        )
+        self.assertMediaFiles(media_files)
+        self.assertEqual(
+            self.field(self.thanks, "Generated Speech"), "[sound:谢谢.mp3]"
+        )
+        self.assertEqual(self.anki.generated_media_files(), generated_media_files)
+
+    def test_second_run_finds_nothing(self) -> None:
+        compact_media(self.anki)
+
+        self.assertEqual(
+            compact_media(self.anki),
+            {
+                "orphaned_files": 0,
+                "duplicate_files": 0,
+                "rewritten_notes": 0,
+                "bytes_reclaimed": 0,
+            },
+        )
+
+    def test_records_referenced_files_as_generated(self) -> None:
+        compact_media(self.anki)
+
+        generated = self.anki.generated_media_files()
+        self.assertIn("你好.mp3", generated)
+        self.assertNotIn("谢谢.mp3", generated)
+        self.assertNotIn("replaced.mp3", generated)
+
+    def test_choose_canonical_prefers_most_referenced_then_shortest_name(self) -> None:
+        references = Counter({"b.mp3": 2, "a.mp3": 1, "long-name.mp3": 2})
+
+        self.assertEqual(
+            _choose_canonical(["a.mp3", "b.mp3", "long-name.mp3"], references), "b.mp3"
+        )
+        self.assertEqual(_choose_canonical(["b.mp3", "a.mp3"], Counter()), "a.mp3")
+
+
+class FakeSynthesizer:
+    def synthesize_mp3(self, text: str, language: Language) -> bytes:
+        return text.encode("utf-8")
+
+
+class TestGeneratedMediaFiles(CompactionTestCase):
+    def test_synthesize_records_generated_file(self) -> None:
+        synthesize(
+            "朋友",
+            anki=self.anki,
+            synthesizer=FakeSynthesizer(),
+            language="Chinese_Simplified",
+            overwrite_target_field=False,
+        )
+
+        self.assertIn("朋友.mp3", self.anki.generated_media_files())
+
+    def test_record_is_saved_on_sync(self) -> None:
+        with patch.object(
+            Collection,
+            "sync_collection",
+            autospec=True,
+            return_value=SyncOutput(required=SyncOutput.NO_CHANGES),
+        ):
+            self.anki.sync()
+        self.anki._collection.close()
+
+        self.assertIn("replaced.mp3", self.open_client().generated_media_files())
+
+
+class TestRunCompactMedia(CompactionTestCase):
+    def run_compact_media(self, dry_run: bool) -> int:
+        """Run the command on the collection prepared by setUp() and return how often it synced."""
+        # The command opens the collection itself.
+        self.anki._collection.close()
+        with (
+            patch.object(
+                Collection,
+                "sync_collection",
+                autospec=True,
+                return_value=SyncOutput(required=SyncOutput.NO_CHANGES),
+            ) as sync_collection,
+            patch(
+                "anki_hanzi.main.compact_media", wraps=compact_media
+            ) as compact_media_spy,
+        ):
+            run_compact_media(
+                "user",
+                "password",
+                self.collection_path,
+                dry_run,
+                anki_endpoint=ENDPOINT,
+            )
+        # Continue with the client used by the command
+        self.anki = compact_media_spy.call_args.args[0]
+        self.addCleanup(self.anki._collection.close)
+        return sync_collection.call_count
+
+    def test_syncs_before_and_after_compaction(self) -> None:
+        self.assertEqual(self.run_compact_media(dry_run=False), 2)
+        self.assertFalse(self.anki.media_file_exists("谢谢.mp3"))
+
+    def test_dry_run_only_syncs_before(self) -> None:
+        self.assertEqual(self.run_compact_media(dry_run=True), 1)
+        self.assertTrue(self.anki.media_file_exists("谢谢.mp3"))
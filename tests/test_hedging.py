@@ -0,0 +1,216 @@
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from datetime import timedelta
+from typing import Any, Callable
+from unittest import TestCase
+
+from google.api_core.exceptions import DeadlineExceeded, ServiceUnavailable
+
+from anki_hanzi.hedging import HedgedCaller
+
+# api_core's exceptions are untyped
+GRPC_TIMEOUT = DeadlineExceeded("grpc timeout")  # type: ignore[no-untyped-call]
+UNAVAILABLE = ServiceUnavailable("unavailable")  # type: ignore[no-untyped-call]
+
+FAST = 0.01
+SLOW = 2.0
+
+
+class FakeAttempt:
+    """Attempt that finishes on a timer thread, stands in for a grpc.Future."""
+
+    _future: Future[str]
+    _timer: threading.Timer
+
+    def __init__(self, after: float, finish: Callable[[Future[str]], None]):
+        self._future = Future()
+        self._timer = threading.Timer(after, self._finish, args=(finish,))
+        self._timer.start()
+
+    def _finish(self, finish: Callable[[Future[str]], None]) -> None:
+        try:
+            finish(self._future)
+        except InvalidStateError:
+            # Cancelled in the meantime
+            pass
+
+    def result(self) -> str:
+        return self._future.result()
+
+    def exception(self) -> BaseException | None:
+        return self._future.exception()
+
+    def cancel(self) -> bool:
+        self._timer.cancel()
+        return self._future.cancel()
+
+    def cancelled(self) -> bool:
+        return self._future.cancelled()
+
+    def add_done_callback(self, fn: Callable[[Any], None]) -> None:
+        self._future.add_done_callback(lambda future: fn(self))
+
+    def alive(self) -> bool:
+        # A cancelled timer needs a moment to wake up and exit.
+        self._timer.join(timeout=FAST * 10)
+        return self._timer.is_alive()
+
+
+Behaviour = Callable[[], FakeAttempt]
+
+
+class ScriptedCall:
+    """Starts the attempt behaviours[n] (or the last one) on the n-th invocation and remembers the timeout."""
+
+    _behaviours: list[Behaviour]
+    _lock: threading.Lock
+    attempts: list[FakeAttempt]
+    timeouts: list[float]
+
+    def __init__(self, *behaviours: Behaviour):
+        self._behaviours = list(behaviours)
+        self._lock = threading.Lock()
+        self.attempts = []
+        self.timeouts = []
+
+    @property
+    def invocations(self) -> int:
+        return len(self.attempts)
+
+    def __call__(self, timeout: float) -> FakeAttempt:
+        with self._lock:
+            index = min(len(self.attempts), len(self._behaviours) - 1)
+            attempt = self._behaviours[index]()
+            self.attempts.append(attempt)
+            self.timeouts.append(timeout)
+        return attempt
+
+
+def respond(result: str, after: float) -> Behaviour:
+    return lambda: FakeAttempt(after, lambda future: future.set_result(result))
+
+
+def fail(error: Exception, after: float = 0.0) -> Behaviour:
+    return lambda: FakeAttempt(after, lambda future: future.set_exception(error))
+
+
+def warmed_up(caller: HedgedCaller, calls: int = 10) -> HedgedCaller:
+    """Make enough fast calls for caller to learn its hedge delay."""
+    for _ in range(calls):
+        caller.call(ScriptedCall(respond("warm-up", FAST)))
+    # Timer jitter can get a warm-up call hedged. Start with the full hedge budget regardless.
+    caller.hedges = 0
+    return caller
+
+
+class TestHedgedCaller(TestCase):
+    def test_call_returns_result_and_passes_remaining_time(self) -> None:
+        caller = HedgedCaller(deadline=timedelta(seconds=5))
+        function = ScriptedCall(respond("result", 0.0))
+
+        self.assertEqual(caller.call(function), "result")
+        self.assertTrue(4 < function.timeouts[0] <= 5)
+        self.assertEqual(caller.calls, 1)
+        self.assertEqual(len(caller.latencies), 1)
+
+    def test_call_raises_deadline_exceeded_when_no_response_in_time(self) -> None:
+        caller = HedgedCaller(deadline=timedelta(seconds=0.1))
+
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            caller.call(ScriptedCall(respond("too late", SLOW)))
+        self.assertLess(time.monotonic() - start, SLOW)
+
+    def test_call_propagates_deadline_exceeded_from_function(self) -> None:
+        # gRPC raises DeadlineExceeded itself if its timeout fires before ours. Both surface as the same type.
+        caller = HedgedCaller(deadline=timedelta(seconds=5))
+
+        with self.assertRaises(DeadlineExceeded):
+            caller.call(ScriptedCall(fail(GRPC_TIMEOUT)))
+
+    def test_call_propagates_errors(self) -> None:
+        caller = HedgedCaller(deadline=timedelta(seconds=5))
+
+        with self.assertRaises(ServiceUnavailable):
+            caller.call(ScriptedCall(fail(UNAVAILABLE)))
+        self.assertEqual(caller.latencies, [])
+
+    def test_no_hedging_unless_enabled(self) -> None:
+        caller = warmed_up(HedgedCaller(hedge=False, min_samples=5))
+        function = ScriptedCall(respond("slow", 0.3), respond("fast", FAST))
+
+        self.assertEqual(caller.call(function), "slow")
+        self.assertEqual(function.invocations, 1)
+        self.assertEqual(caller.hedges, 0)
+
+    def test_no_hedging_before_enough_samples(self) -> None:
+        caller = HedgedCaller(hedge=True, min_samples=5)
+        function = ScriptedCall(respond("slow", 0.3), respond("fast", FAST))
+
+        self.assertEqual(caller.call(function), "slow")
+        self.assertEqual(function.invocations, 1)
+        self.assertEqual(caller.hedges, 0)
+
+    def test_slow_call_is_hedged(self) -> None:
+        caller = warmed_up(HedgedCaller(hedge=True, min_samples=5))
+        function = ScriptedCall(respond("slow", SLOW), respond("fast", FAST))
+
+        start = time.monotonic()
+        self.assertEqual(caller.call(function), "fast")
+        self.assertLess(time.monotonic() - start, SLOW / 2)
+        self.assertEqual(function.invocations, 2)
+        self.assertEqual(caller.hedges, 1)
+
+    def test_losing_request_is_cancelled(self) -> None:
+        caller = warmed_up(HedgedCaller(hedge=True, min_samples=5))
+        function = ScriptedCall(respond("slow", SLOW), respond("fast", FAST))
+
+        caller.call(function)
+
+        loser = function.attempts[0]
+        self.assertTrue(loser.cancelled())
+        self.assertFalse(loser.alive())
+
+    def test_request_is_cancelled_when_deadline_is_exceeded(self) -> None:
+        caller = HedgedCaller(deadline=timedelta(seconds=0.1))
+        function = ScriptedCall(respond("too late", SLOW))
+
+        with self.assertRaises(DeadlineExceeded):
+            caller.call(function)
+        self.assertTrue(function.attempts[0].cancelled())
+
+    def test_fast_call_is_not_hedged(self) -> None:
+        caller = warmed_up(HedgedCaller(hedge=True, min_samples=5))
+        function = ScriptedCall(respond("fast", 0.0))
+
+        self.assertEqual(caller.call(function), "fast")
+        self.assertEqual(function.invocations, 1)
+        self.assertEqual(caller.hedges, 0)
+
+    def test_hedges_are_capped_by_budget(self) -> None:
+        # After 10 warm-up calls, a ratio of 0.1 allows one hedge on the 11th call but not a second one on the 12th.
+        caller = warmed_up(HedgedCaller(hedge=True, min_samples=5, max_hedge_ratio=0.1))
+
+        first = ScriptedCall(respond("slow", 0.3), respond("fast", FAST))
+        self.assertEqual(caller.call(first), "fast")
+        second = ScriptedCall(respond("slow", 0.3), respond("fast", FAST))
+        self.assertEqual(caller.call(second), "slow")
+
+        self.assertEqual(second.invocations, 1)
+        self.assertEqual(caller.hedges, 1)
+
+    def test_hedge_wins_if_original_request_fails(self) -> None:
+        caller = warmed_up(HedgedCaller(hedge=True, min_samples=5))
+        function = ScriptedCall(fail(UNAVAILABLE, after=0.3), respond("hedge", 0.5))
+
+        self.assertEqual(caller.call(function), "hedge")
+        self.assertEqual(caller.hedges, 1)
+
+    def test_error_raised_if_original_and_hedge_fail(self) -> None:
+        caller = warmed_up(HedgedCaller(hedge=True, min_samples=5))
+        function = ScriptedCall(fail(UNAVAILABLE, after=0.3))
+
+        with self.assertRaises(ServiceUnavailable):
+            caller.call(function)
+        self.assertEqual(function.invocations, 2)